@@ -0,0 +1,129 @@
+"""Shared machinery for the labs' run_tests.py scripts.
+
+duality/run_tests.py and server/run_tests.py used to duplicate their
+scaffolding (argument parsing, settings loading, color handling, the
+prebuilt-binary helper, the worker pool). That now lives here; each
+lab's script keeps only its own validation logic and plugs it in as a
+per-suite callback.
+"""
+import argparse
+import atexit
+import json
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+# orjson parses faster than stdlib json; fall back if it isn't installed
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+# Emit ANSI escapes only on a real terminal; honor the NO_COLOR
+# convention so piped/CI output stays free of escape bytes.
+_TTY = sys.stdout.isatty() and 'NO_COLOR' not in os.environ
+
+# ANSI Colors for terminal output
+class Colors:
+    GREEN = '\033[92m' if _TTY else ''
+    RED = '\033[91m' if _TTY else ''
+    YELLOW = '\033[93m' if _TTY else ''
+    RESET = '\033[0m' if _TTY else ''
+    BOLD = '\033[1m' if _TTY else ''
+
+# GNU diff (C, Myers' algorithm) is much faster than difflib's pure
+# Python matcher for large outputs; fall back to difflib without it.
+DIFF_TOOL = shutil.which("diff")
+
+# Shared worker pool, created lazily and reused across all suites so we
+# pay thread spawn cost once per process.
+_POOL = None
+
+def pool():
+    global _POOL
+    if _POOL is None:
+        _POOL = ThreadPoolExecutor(max_workers=os.cpu_count())
+        atexit.register(_POOL.shutdown)
+    return _POOL
+
+def make_parser(description):
+    """Build the argument parser shared by both scripts (--tags)."""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--tags", help="Optional build tags to pass to the Go build", default=None)
+    return parser
+
+def warn_if_no_posix_spawn():
+    # CPython spawns subprocesses via the cheaper posix_spawn when the
+    # kwargs allow it; note when this interpreter can't take that path.
+    if not getattr(subprocess, "_USE_POSIX_SPAWN", False):
+        print("Note: posix_spawn unavailable; process startup may be slower.", file=sys.stderr)
+
+def load_settings(settings_file='settings.json'):
+    """Load and parse settings.json, exiting with a message on failure.
+
+    The parsed dict is snapshotted to .cache/settings.pkl keyed on the
+    JSON file's mtime; unpickling (C) is cheaper than re-parsing JSON,
+    so repeated invocations skip the parse entirely.
+    """
+    if not os.path.exists(settings_file):
+        print(f"{Colors.RED}Error: {settings_file} not found.{Colors.RESET}")
+        sys.exit(1)
+
+    st = os.stat(settings_file)
+    cache_path = os.path.join('.cache', 'settings.pkl')
+    try:
+        if os.stat(cache_path).st_mtime_ns >= st.st_mtime_ns:
+            with open(cache_path, 'rb') as f:
+                return pickle.load(f)
+    except (OSError, pickle.PickleError, EOFError):
+        pass  # no snapshot, stale, or unreadable; fall through and parse
+
+    # orjson wants bytes, json accepts them too
+    with open(settings_file, 'rb') as f:
+        try:
+            settings = _loads(f.read())
+        except ValueError as e:
+            print(f"{Colors.RED}Error parsing JSON: {e}{Colors.RESET}")
+            sys.exit(1)
+
+    try:
+        os.makedirs('.cache', exist_ok=True)
+        with open(cache_path, 'wb') as f:
+            pickle.dump(settings, f, protocol=5)
+    except OSError:
+        pass  # a read-only checkout just re-parses next time
+
+    return settings
+
+def make_bin_dir(prefix):
+    """Create a temp directory for prebuilt suite binaries, cleaned at exit."""
+    bin_dir = tempfile.mkdtemp(prefix=prefix)
+    atexit.register(shutil.rmtree, bin_dir, ignore_errors=True)
+    return bin_dir
+
+def build_suite(go_file, tags, bin_dir):
+    """Compile a suite's .go file once and return the path to the binary.
+
+    Raises subprocess.CalledProcessError if the build fails.
+    """
+    bin_path = os.path.join(bin_dir, os.path.splitext(go_file)[0])
+    cmd = ["go", "build", "-o", bin_path]
+    if tags:
+        cmd.extend(["-tags", tags])
+    cmd.append(go_file)
+    subprocess.run(cmd, check=True)
+    return bin_path
+
+def run_suites(suite_names, run_suite):
+    """Run each suite's callback concurrently on the shared pool.
+
+    Each callback returns its suite's buffered log text; logs are
+    flushed in submission order so the report stays deterministic.
+    """
+    futures = [pool().submit(run_suite, name) for name in suite_names]
+    sys.stdout.write(''.join(f.result() for f in futures))
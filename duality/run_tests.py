@@ -3,35 +3,30 @@ import subprocess
 import os
 import sys
 import difflib
-import argparse
+import io
+from dataclasses import dataclass
 
-# ANSI Colors for terminal output
-class Colors:
-    GREEN = '\033[92m'
-    RED = '\033[91m'
-    RESET = '\033[0m'
-    BOLD = '\033[1m'
+# The shared runner lives at the repo root, one level up from each lab
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from _runner import (Colors, DIFF_TOOL, _loads, build_suite, load_settings,
+                     make_bin_dir, make_parser, pool, warn_if_no_posix_spawn)
+
+@dataclass
+class Result:
+    """Outcome of a single test: points earned and its buffered log text."""
+    passed: bool
+    points: int
+    log: str
 
 def run_tests():
-    # --- NEW: Argument Parsing ---
-    parser = argparse.ArgumentParser(description="Run Go tests defined in settings.json")
-    parser.add_argument("--tags", help="Optional build tags to pass to go run (e.g., 'lock')", default=None)
+    parser = make_parser("Run Go tests defined in settings.json")
+    parser.add_argument("--diff", action="store_true",
+                        help="Write a unified diff for failing tests (slower; off by default)")
     cli_args = parser.parse_args()
-    # -----------------------------
 
-    settings_file = 'settings.json'
-    
-    if not os.path.exists(settings_file):
-        print(f"{Colors.RED}Error: {settings_file} not found.{Colors.RESET}")
-        sys.exit(1)
+    warn_if_no_posix_spawn()
 
-    # 1. Load settings
-    with open(settings_file, 'r') as f:
-        try:
-            settings = json.load(f)
-        except json.JSONDecodeError as e:
-            print(f"{Colors.RED}Error parsing JSON: {e}{Colors.RESET}")
-            sys.exit(1)
+    settings = load_settings()
 
     test_dir = settings.get('test_dir', '.')
     suite_names = settings.get('test_suite_names', [])
@@ -45,96 +40,196 @@ def run_tests():
     total_points = 0
     max_points = 0
 
+    # Temp directory for prebuilt suite binaries (compile once per suite,
+    # not once per test).
+    bin_dir = make_bin_dir("run_tests_")
+    suite_bins = {}
+
+    # Sidecar metadata for reusing prior runs: if the .go source, args,
+    # and tags are unchanged since the last run, the saved actual output
+    # is still valid and the test (and even the build) can be skipped.
+    cache_dir = '.cache'
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # One directory scan up front instead of 3 stat calls per test;
+    # membership checks against these sets are pure in-memory lookups.
+    test_entries = {e.name for e in os.scandir(test_dir)}
+    cache_entries = {e.name for e in os.scandir(cache_dir)}
+
     # 2. Iterate through suites
     for suite_name in suite_names:
         print(f"\n{Colors.BOLD}=== Running Suite: {suite_name} ==={Colors.RESET}")
-        
+
         go_file = f"{suite_name}.go"
         if not os.path.exists(go_file):
             print(f"{Colors.RED}Warning: File {go_file} not found. Skipping suite.{Colors.RESET}")
             continue
 
         tests = all_suites.get(suite_name, [])
+        go_mtime_ns = os.stat(go_file).st_mtime_ns
+
+        # Resolve the per-suite path prefixes once; every per-test path
+        # below is then a single f-string instead of an os.path.join call.
+        prefix = os.path.join(test_dir, suite_name)
+        cache_prefix = os.path.join(cache_dir, suite_name)
 
-        for i, test in enumerate(tests):
+        def cache_key(test_args):
+            return [go_mtime_ns, test_args, cli_args.tags]
+
+        def cache_fresh(i, test):
+            if not (f"{suite_name}_{i}.meta" in cache_entries
+                    and f"{suite_name}_actual_{i}.txt" in test_entries):
+                return False
+            try:
+                with open(f"{cache_prefix}_{i}.meta", 'rb') as f:
+                    return _loads(f.read()).get('key') == cache_key(test.get('args', []))
+            except (ValueError, OSError):
+                return False
+
+        fresh = [cache_fresh(i, t) for i, t in enumerate(tests)]
+
+        if tests and all(fresh):
+            # Nothing changed since the last run; no need to compile
+            print("  [Info] Source and args unchanged; reusing cached outputs.")
+        else:
+            # Build the suite binary once so each test only pays exec cost
+            if cli_args.tags:
+                print(f"  [Info] Using tags: {cli_args.tags}")
+            try:
+                suite_bins[suite_name] = build_suite(go_file, cli_args.tags, bin_dir)
+            except (subprocess.CalledProcessError, OSError) as e:
+                print(f"{Colors.RED}Error: Failed to build {go_file}: {e}. Skipping suite.{Colors.RESET}")
+                continue
+
+        # Preload expected outputs once per suite so the compare step is a
+        # pure in-memory equality check with no per-test file I/O.
+        # Kept as tuples of raw bytes lines; nothing is decoded unless a
+        # test fails and a diff is requested.
+        expected_cache = {}
+        for i in range(len(tests)):
+            if f"{suite_name}_expected_{i}.txt" in test_entries:
+                with open(f"{prefix}_expected_{i}.txt", 'rb') as f:
+                    # rstrip, not strip: trimming only the trailing end is
+                    # cheaper and keeps any leading blank lines significant
+                    expected_cache[i] = tuple(f.read().rstrip().splitlines())
+
+        def run_one(i, test):
+            """Run a single test and return its Result.
+
+            Each test is an independent subprocess with its own
+            actual/expected/diff files, so tests can run concurrently.
+            Output is buffered so concurrent tests don't interleave.
+            """
             description = test.get('desc', f'Test #{i}')
             test_args = test.get('args', [])
             points = test.get('points', 0)
-            max_points += points
 
-            print(f"\nTest {i}: {description} (Points: {points})")
-            
+            log = io.StringIO()
+            log.write(f"\nTest {i}: {description} (Points: {points})\n")
+
             # Construct filenames
-            expected_path = os.path.join(test_dir, f"{suite_name}_expected_{i}.txt")
-            actual_path = os.path.join(test_dir, f"{suite_name}_actual_{i}.txt")
-            diff_path = os.path.join(test_dir, f"{suite_name}_diff_{i}.txt")
-
-            # --- NEW: Construct Command with Tags ---
-            # Format: go run [-tags <tags>] <file.go> <args>
-            cmd = ["go", "run"]
-            
-            if cli_args.tags:
-                print(f"  [Info] Using tags: {cli_args.tags}")
-                cmd.extend(["-tags", cli_args.tags])
-            
-            cmd.append(go_file)
-            cmd.extend(test_args)
-            # ----------------------------------------
+            expected_path = f"{prefix}_expected_{i}.txt"
+            actual_path = f"{prefix}_actual_{i}.txt"
+            diff_path = f"{prefix}_diff_{i}.txt"
 
             try:
-                result = subprocess.run(
-                    cmd,
-                    capture_output=True,
-                    text=True
-                )
-                
-                actual_output = result.stdout
-                
-                # Write Actual Output
-                with open(actual_path, 'w') as f:
-                    f.write(actual_output)
-
-                # Check if Expected file exists
-                if not os.path.exists(expected_path):
-                    print(f"  {Colors.RED}[ERROR]{Colors.RESET} Expected file not found: {expected_path}")
-                    print(f"  Saved actual output to: {actual_path}")
-                    continue
-
-                # Read Expected Output
-                with open(expected_path, 'r') as f:
-                    expected_output = f.read()
-
-                # 4. Compare Outputs
-                actual_lines = actual_output.strip().splitlines()
-                expected_lines = expected_output.strip().splitlines()
-
-                if actual_lines == expected_lines:
+                if fresh[i]:
+                    # Identical source/args/tags as the prior run; reuse
+                    # the saved output instead of spawning at all.
+                    with open(actual_path, 'rb') as f:
+                        actual_output = f.read()
+                else:
+                    # Exec the prebuilt suite binary (tags were applied at
+                    # build time). Keep the kwargs posix_spawn-friendly
+                    # (no preexec_fn / pass_fds) and skip stderr entirely;
+                    # only stdout is used.
+                    cmd = [suite_bins[suite_name]] + test_args
+                    result = subprocess.run(
+                        cmd,
+                        stdout=subprocess.PIPE,
+                        stderr=subprocess.DEVNULL
+                    )
+
+                    actual_output = result.stdout
+
+                    # Write Actual Output (raw bytes, no transcoding)
+                    with open(actual_path, 'wb') as f:
+                        f.write(actual_output)
+
+                    # Record what produced this output for future reuse
+                    with open(f"{cache_prefix}_{i}.meta", 'w') as f:
+                        json.dump({'key': cache_key(test_args)}, f)
+
+                # Look up the preloaded expected output
+                expected_lines = expected_cache.get(i)
+                if expected_lines is None:
+                    log.write(f"  {Colors.RED}[ERROR]{Colors.RESET} Expected file not found: {expected_path}\n")
+                    log.write(f"  Saved actual output to: {actual_path}\n")
+                    return Result(False, 0, log.getvalue())
+
+                # 4. Compare Outputs (rstrip to match the expected cache)
+                actual_lines = actual_output.rstrip().splitlines()
+
+                if tuple(actual_lines) == expected_lines:
                     # PASS
-                    print(f"  {Colors.GREEN}[PASS]{Colors.RESET} Output matches expected.")
-                    total_points += points
-                    
-                    if os.path.exists(diff_path):
+                    log.write(f"  {Colors.GREEN}[PASS]{Colors.RESET} Output matches expected.\n")
+
+                    if f"{suite_name}_diff_{i}.txt" in test_entries:
                         os.remove(diff_path)
+                    return Result(True, points, log.getvalue())
                 else:
                     # FAIL
-                    print(f"  {Colors.RED}[FAIL]{Colors.RESET} Output mismatch.")
-                    
-                    diff = difflib.unified_diff(
-                        expected_lines, 
-                        actual_lines, 
-                        fromfile=f'expected_{i}', 
-                        tofile=f'actual_{i}',
-                        lineterm=''
-                    )
-                    
-                    with open(diff_path, 'w') as f:
-                        f.write('\n'.join(diff))
-                    
-                    print(f"  Saved actual output to: {actual_path}")
-                    print(f"  Saved diff to: {diff_path}")
+                    log.write(f"  {Colors.RED}[FAIL]{Colors.RESET} Output mismatch.\n")
+                    log.write(f"  Saved actual output to: {actual_path}\n")
+
+                    # Diffing is quadratic in the worst case; only pay for
+                    # it when explicitly requested via --diff.
+                    if cli_args.diff:
+                        if DIFF_TOOL:
+                            # Both files are already on disk; let the C
+                            # implementation do the heavy lifting.
+                            with open(diff_path, 'w') as f:
+                                subprocess.run(
+                                    [DIFF_TOOL, "-u",
+                                     "--label", f"expected_{i}",
+                                     "--label", f"actual_{i}",
+                                     expected_path, actual_path],
+                                    stdout=f,
+                                    stderr=subprocess.DEVNULL
+                                )
+                        else:
+                            # difflib wants str; decode only on this cold path
+                            diff = difflib.unified_diff(
+                                [l.decode('utf-8', 'replace') for l in expected_lines],
+                                [l.decode('utf-8', 'replace') for l in actual_lines],
+                                fromfile=f'expected_{i}',
+                                tofile=f'actual_{i}',
+                                lineterm=''
+                            )
+
+                            # Stream the diff to disk line by line instead
+                            # of materializing the whole thing in memory.
+                            with open(diff_path, 'w') as f:
+                                f.writelines(line + '\n' for line in diff)
+
+                        log.write(f"  Saved diff to: {diff_path}\n")
+                    return Result(False, 0, log.getvalue())
 
             except Exception as e:
-                print(f"  {Colors.RED}[ERROR]{Colors.RESET} Execution failed: {e}")
+                log.write(f"  {Colors.RED}[ERROR]{Colors.RESET} Execution failed: {e}\n")
+                return Result(False, 0, log.getvalue())
+
+        # Dispatch tests concurrently on the shared pool; collect in
+        # submission order so the report prints deterministically.
+        futures = [pool().submit(run_one, i, t) for i, t in enumerate(tests)]
+        results = [f.result() for f in futures]
+
+        for test, res in zip(tests, results):
+            max_points += test.get('points', 0)
+            total_points += res.points
+
+        # One write per suite instead of one syscall per print
+        sys.stdout.write(''.join(res.log for res in results))
 
     # 5. Final Score
     print("\n" + "="*30)
@@ -143,4 +238,4 @@ def run_tests():
     print("="*30)
 
 if __name__ == "__main__":
-    run_tests()
\ No newline at end of file
+    run_tests()
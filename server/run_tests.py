@@ -1,38 +1,70 @@
-import json
 import subprocess
 import os
 import sys
-import argparse
 import re
-
-# ANSI Colors for terminal output
-class Colors:
-    GREEN = '\033[92m'
-    RED = '\033[91m'
-    YELLOW = '\033[93m'
-    RESET = '\033[0m'
-    BOLD = '\033[1m'
+import io
+from dataclasses import dataclass
+
+# The shared runner lives at the repo root, one level up from each lab
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from _runner import (Colors, build_suite, load_settings, make_bin_dir,
+                     make_parser, run_suites, warn_if_no_posix_spawn)
+
+# Precompiled; matches e.g. "throughput=196/sec meanRT=408.708ms" in one
+# scan of the output instead of two searches per test.
+_METRICS_RE = re.compile(r'throughput=([\d.]+)/sec.*?meanRT=([\d.]+)ms', re.DOTALL)
+
+@dataclass(slots=True)
+class Plan:
+    """A test's inputs plus its precomputed expected performance metrics."""
+    desc: str
+    args: list
+    points: int
+    iat_mean: float = 0.0
+    demand_mean: float = 0.0
+    max_concurrent: int = 0
+    expected_lambda: float = 0.0
+    max_throughput: float = 0.0
+    is_saturated: bool = False
+    error: str = ""
+
+def _plan(i, test):
+    """Precompute one test's expected metrics from its settings entry.
+
+    Units: iatMean and demandMean are in ms. Throughput is req/sec.
+    Usage: serveload <iatMean> <demandMean> <maxConcurrent>
+    """
+    desc = test.get('desc', f'Test #{i}')
+    plan = Plan(desc, test.get('args', []), test.get('points', 0))
+
+    if len(plan.args) < 3:
+        plan.error = f"Test '{desc}' missing arguments."
+        return plan
+
+    try:
+        plan.iat_mean = float(plan.args[0])
+        plan.demand_mean = float(plan.args[1])
+        plan.max_concurrent = int(plan.args[2])
+    except ValueError:
+        plan.error = "Invalid arguments for math calculation."
+        return plan
+
+    # Expected Load (Lambda) = 1000 / iatMean
+    plan.expected_lambda = 1000.0 / plan.iat_mean if plan.iat_mean > 0 else 0
+
+    # Max Throughput Capacity = (maxConcurrent * 1000) / demandMean
+    plan.max_throughput = (plan.max_concurrent * 1000.0) / plan.demand_mean if plan.demand_mean > 0 else 0
+
+    plan.is_saturated = plan.expected_lambda >= plan.max_throughput
+    return plan
 
 def run_perf_tests():
-    # --- Argument Parsing ---
-    parser = argparse.ArgumentParser(description="Run Go performance tests defined in settings.json")
-    parser.add_argument("--tags", help="Optional build tags to pass to go run", default=None)
+    parser = make_parser("Run Go performance tests defined in settings.json")
     cli_args = parser.parse_args()
-    # ------------------------
 
-    settings_file = 'settings.json'
-    
-    if not os.path.exists(settings_file):
-        print(f"{Colors.RED}Error: {settings_file} not found.{Colors.RESET}")
-        sys.exit(1)
+    warn_if_no_posix_spawn()
 
-    # 1. Load settings
-    with open(settings_file, 'r') as f:
-        try:
-            settings = json.load(f)
-        except json.JSONDecodeError as e:
-            print(f"{Colors.RED}Error parsing JSON: {e}{Colors.RESET}")
-            sys.exit(1)
+    settings = load_settings()
 
     test_dir = settings.get('test_dir', '.')
     suite_names = settings.get('test_suite_names', [])
@@ -43,123 +75,162 @@ def run_perf_tests():
     #     sys.exit(1)
 
     # Tolerance for "reasonable range" (e.g., +/- 20%)
-    TOLERANCE = 0.20 
+    TOLERANCE = 0.20
 
+    # Temp directory for prebuilt suite binaries (compile once per suite,
+    # not once per test input tuple). All builds happen up front, before
+    # any measurement starts, so compilation never steals CPU from a
+    # concurrently running perf test.
+    bin_dir = make_bin_dir("run_perf_tests_")
+
+    suite_bins = {}
+    build_errors = {}
     for suite_name in suite_names:
-        print(f"\n{Colors.BOLD}=== Running Performance Suite: {suite_name} ==={Colors.RESET}")
-        
         go_file = f"{suite_name}.go"
         if not os.path.exists(go_file):
-            print(f"{Colors.RED}Warning: File {go_file} not found. Skipping suite.{Colors.RESET}")
             continue
+        try:
+            suite_bins[suite_name] = build_suite(go_file, cli_args.tags, bin_dir)
+        except (subprocess.CalledProcessError, OSError) as e:
+            build_errors[suite_name] = e
+
+    def run_suite(suite_name):
+        """Run one suite's perf tests serially and return its buffered log.
+
+        Perf tests within a suite stay sequential (concurrent runs would
+        contend for CPU and skew latency), but independent suites can
+        overlap. Output is buffered so suites don't interleave.
+        """
+        log = io.StringIO()
+        log.write(f"\n{Colors.BOLD}=== Running Performance Suite: {suite_name} ==={Colors.RESET}\n")
+
+        go_file = f"{suite_name}.go"
+        if suite_name in build_errors:
+            log.write(f"{Colors.RED}Error: Failed to build {go_file}: {build_errors[suite_name]}. Skipping suite.{Colors.RESET}\n")
+            return log.getvalue()
+        if suite_name not in suite_bins:
+            log.write(f"{Colors.RED}Warning: File {go_file} not found. Skipping suite.{Colors.RESET}\n")
+            return log.getvalue()
+        suite_bin = suite_bins[suite_name]
 
         tests = all_suites.get(suite_name, [])
 
-        for i, test in enumerate(tests):
-            description = test.get('desc', f'Test #{i}')
-            args = test.get('args', [])
-            points = test.get('points', 0)
-            
-            # Identify expected parameter indices based on serveload.go usage
-            # Usage: go run serveload.go <iatMean> <demandMean> <maxConcurrent>
-            if len(args) < 3:
-                print(f"{Colors.RED}Error: Test '{description}' missing arguments.{Colors.RESET}")
-                continue
+        # Precompute every test's expected metrics up front; the
+        # measurement loop below is then pure dispatch.
+        plans = [_plan(i, t) for i, t in enumerate(tests)]
 
-            try:
-                iat_mean = float(args[0])
-                demand_mean = float(args[1])
-                max_concurrent = int(args[2])
-            except ValueError:
-                print(f"{Colors.RED}Error: Invalid arguments for math calculation.{Colors.RESET}")
+        # --- Phase 1: Measure ---
+        # Run every test and collect its metrics; verdicts are computed
+        # afterwards in one validation pass over the whole batch, keeping
+        # Python arithmetic out of the measurement loop. Each test's
+        # preamble is buffered separately so verdicts can be appended
+        # under the right header.
+        measured = []  # (preamble_text, metrics or None) per test
+
+        for i, plan in enumerate(plans):
+            buf = io.StringIO()
+
+            if plan.error:
+                buf.write(f"{Colors.RED}Error: {plan.error}{Colors.RESET}\n")
+                measured.append((buf.getvalue(), None))
                 continue
 
-            # --- Calculate Expected Performance Metrics ---
-            # Units: iatMean and demandMean are in ms. Throughput is req/sec.
-            
-            # Expected Load (Lambda) = 1000 / iatMean
-            expected_lambda = 1000.0 / iat_mean if iat_mean > 0 else 0
-            
-            # Max Throughput Capacity = (maxConcurrent * 1000) / demandMean
-            max_throughput = (max_concurrent * 1000.0) / demand_mean if demand_mean > 0 else 0
-
-            is_saturated = expected_lambda >= max_throughput
-
-            print(f"\nTest {i}: {description}")
-            print(f"  Input: IAT={iat_mean}ms, Demand={demand_mean}ms, Concurrent={max_concurrent}")
-            print(f"  Calculated: Lambda={expected_lambda:.1f}/sec, MaxCap={max_throughput:.1f}/sec")
-            print(f"  Mode: {Colors.YELLOW}{'SATURATED' if is_saturated else 'NOT SATURATED'}{Colors.RESET}")
-
-            # --- Construct Command ---
-            cmd = ["go", "run"]
-            if cli_args.tags:
-                cmd.extend(["-tags", cli_args.tags])
-            cmd.append(go_file)
-            cmd.extend(args)
+            buf.write(f"\nTest {i}: {plan.desc}\n")
+            buf.write(f"  Input: IAT={plan.iat_mean}ms, Demand={plan.demand_mean}ms, Concurrent={plan.max_concurrent}\n")
+            buf.write(f"  Calculated: Lambda={plan.expected_lambda:.1f}/sec, MaxCap={plan.max_throughput:.1f}/sec\n")
+            buf.write(f"  Mode: {Colors.YELLOW}{'SATURATED' if plan.is_saturated else 'NOT SATURATED'}{Colors.RESET}\n")
+
+            # Exec the prebuilt suite binary (tags were applied at build time)
+            cmd = [suite_bin] + plan.args
 
             try:
+                # Keep the kwargs posix_spawn-friendly (no preexec_fn /
+                # pass_fds) and skip stderr entirely; only stdout is used.
                 result = subprocess.run(
                     cmd,
-                    capture_output=True,
-                    text=True
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL
                 )
-                
-                output = result.stdout
-                
+
+                output = result.stdout.decode('utf-8', 'replace')
+
                 # --- Parse Actual Output ---
-                # Looking for: throughput=196/sec meanRT=408.708ms
-                tp_match = re.search(r'throughput=([\d\.]+)/sec', output)
-                rt_match = re.search(r'meanRT=([\d\.]+)ms', output)
+                metrics = _METRICS_RE.search(output)
 
-                if not tp_match or not rt_match:
-                    print(f"  {Colors.RED}[ERROR] Could not parse output.{Colors.RESET}")
-                    print(f"  Stdout: {output.strip()}")
+                if not metrics:
+                    buf.write(f"  {Colors.RED}[ERROR] Could not parse output.{Colors.RESET}\n")
+                    buf.write(f"  Stdout: {output.strip()}\n")
+                    measured.append((buf.getvalue(), None))
                     continue
 
-                actual_throughput = float(tp_match.group(1))
-                actual_mean_rt = float(rt_match.group(1))
-
-                # --- Validation Logic ---
-                passed = False
-                msg = ""
-
-                if is_saturated:
-                    # Metric: Throughput
-                    # Condition: Actual throughput should be close to Max Throughput
-                    lower_bound = max_throughput * (1.0 - TOLERANCE)
-                    upper_bound = max_throughput * (1.0 + TOLERANCE)
-                    
-                    if lower_bound <= actual_throughput <= upper_bound:
-                        passed = True
-                        msg = f"Throughput {actual_throughput:.1f} is within range of max {max_throughput:.1f}"
-                    else:
-                        msg = f"Throughput {actual_throughput:.1f} OUT OF RANGE (Expected ~{max_throughput:.1f})"
+                actual_throughput = float(metrics.group(1))
+                actual_mean_rt = float(metrics.group(2))
+
+            except Exception as e:
+                buf.write(f"  {Colors.RED}[ERROR] Execution failed: {e}{Colors.RESET}\n")
+                measured.append((buf.getvalue(), None))
+                continue
+
+            measured.append((buf.getvalue(),
+                             (plan, actual_throughput, actual_mean_rt,
+                              metrics.group(1), metrics.group(2))))
+
+        # --- Phase 2: Validate ---
+        # One pass over the collected metrics; the tolerance checks are
+        # plain float compares, so the batch stays stdlib-only.
+        for preamble, m in measured:
+            log.write(preamble)
+            if m is None:
+                continue
+
+            plan, actual_throughput, actual_mean_rt, tp_raw, rt_raw = m
+            max_throughput = plan.max_throughput
+            demand_mean = plan.demand_mean
+
+            passed = False
+            msg = ""
+
+            if plan.is_saturated:
+                # Metric: Throughput
+                # Condition: Actual throughput should be close to Max Throughput
+                lower_bound = max_throughput * (1.0 - TOLERANCE)
+                upper_bound = max_throughput * (1.0 + TOLERANCE)
+
+                if lower_bound <= actual_throughput <= upper_bound:
+                    passed = True
+                    msg = f"Throughput {actual_throughput:.1f} is within range of max {max_throughput:.1f}"
                 else:
-                    # Metric: MeanRT
-                    # Condition: Actual MeanRT should be close to DemandMean
-                    # Note: RT can only be >= DemandMean. We allow some overhead (tolerance).
-                    # A simplistic check: Within 20% or simply 'reasonable' (e.g. up to 1.5x if needed)
-                    # Using standard tolerance for now:
-                    target_rt = demand_mean
-                    lower_bound = target_rt * 0.9 # It physically can't be much lower than service time
-                    upper_bound = target_rt * (1.0 + TOLERANCE) 
-                    
-                    if lower_bound <= actual_mean_rt <= upper_bound:
-                        passed = True
-                        msg = f"MeanRT {actual_mean_rt:.1f}ms is within range of demand {demand_mean}ms"
-                    else:
-                        # If unsaturated but RT is high, it might be close to saturation boundary
-                        msg = f"MeanRT {actual_mean_rt:.1f}ms OUT OF RANGE (Expected ~{demand_mean}ms)"
-
-                # --- Print Result ---
-                if passed:
-                    print(f"  {Colors.GREEN}[PASS]{Colors.RESET} {msg}")
+                    msg = f"Throughput {actual_throughput:.1f} OUT OF RANGE (Expected ~{max_throughput:.1f})"
+            else:
+                # Metric: MeanRT
+                # Condition: Actual MeanRT should be close to DemandMean
+                # Note: RT can only be >= DemandMean. We allow some overhead (tolerance).
+                # A simplistic check: Within 20% or simply 'reasonable' (e.g. up to 1.5x if needed)
+                # Using standard tolerance for now:
+                target_rt = demand_mean
+                lower_bound = target_rt * 0.9 # It physically can't be much lower than service time
+                upper_bound = target_rt * (1.0 + TOLERANCE)
+
+                if lower_bound <= actual_mean_rt <= upper_bound:
+                    passed = True
+                    msg = f"MeanRT {actual_mean_rt:.1f}ms is within range of demand {demand_mean}ms"
                 else:
-                    print(f"  {Colors.RED}[FAIL]{Colors.RESET} {msg}")
-                    print(f"  Actual Output Line: {tp_match.group(0)} {rt_match.group(0)}")
+                    # If unsaturated but RT is high, it might be close to saturation boundary
+                    msg = f"MeanRT {actual_mean_rt:.1f}ms OUT OF RANGE (Expected ~{demand_mean}ms)"
 
-            except Exception as e:
-                print(f"  {Colors.RED}[ERROR] Execution failed: {e}{Colors.RESET}")
+            # --- Print Result ---
+            if passed:
+                log.write(f"  {Colors.GREEN}[PASS]{Colors.RESET} {msg}\n")
+            else:
+                log.write(f"  {Colors.RED}[FAIL]{Colors.RESET} {msg}\n")
+                log.write(f"  Actual Output Line: throughput={tp_raw}/sec meanRT={rt_raw}ms\n")
+
+        return log.getvalue()
+
+    # Run suites concurrently on the shared pool; flush each suite's
+    # buffered log with one write, in submission order, so the report
+    # stays deterministic.
+    run_suites(suite_names, run_suite)
 
 if __name__ == "__main__":
-    run_perf_tests()
\ No newline at end of file
+    run_perf_tests()